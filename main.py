@@ -1,19 +1,30 @@
 # навайбкодил
+import time
+startup_t0 = time.perf_counter()
 import asyncio
 import re
 import logging
 import json
 import os
-import aiohttp
-import time
+import sys
+import signal
+import subprocess
+import hashlib
+import contextlib
+import sqlite3
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
-from PIL import Image, ImageDraw, ImageFont
+# aiohttp и Pillow грузятся при первом использовании, чтобы бот быстрее стартовал
+startup_timings = {"импорт stdlib": time.perf_counter() - startup_t0}
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, BotCommand, ReactionTypeEmoji
 from telegram.ext import (
     Application, CommandHandler, MessageHandler, CallbackQueryHandler,
-    ContextTypes, filters, ConversationHandler
+    ContextTypes, filters, ConversationHandler, TypeHandler, ApplicationHandlerStop,
+    BaseUpdateProcessor
 )
 from telegram.error import BadRequest
+startup_timings["импорт telegram"] = time.perf_counter() - startup_t0
 
 # сегодня и завтра
 TOKEN = os.getenv('BOT_TOKEN')
@@ -23,16 +34,70 @@ OSU_CLIENT_SECRET = os.getenv('OSU_SECRET')
 IRC_HOST = "irc.ppy.sh"
 IRC_PORT = 6667
 DEFAULT_CHANNEL = "#osu"
+# шардинг: SHARDS=0 — всё в одном процессе, иначе фронт + N воркеров
+SHARDS = int(os.getenv('SHARDS', '0'))
+# unix-сокет с правами 0600: по нему ходят апдейты с IRC паролями, чужим процессам туда нельзя
+SHARD_SOCKET = os.getenv('SHARD_SOCKET', 'osu_shards.sock')
+SHARD_SETTLE = float(os.getenv('SHARD_SETTLE', '5'))  # сколько ждать всех воркеров перед раздачей чатов
+SHARD_HANDOFF_TIMEOUT = 10  # сколько фронт ждёт, пока воркеры отпустят переехавшие чаты
+# вебхук вместо long polling: WEBHOOK_URL — публичный адрес за реверс-прокси
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '127.0.0.1')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', 'tg')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '40'))
+CONCURRENT_UPDATES = int(os.getenv('CONCURRENT_UPDATES', '1'))
+PROCESSOR_BASE_LIMIT = 100000  # лимит семафора PTB, реальный — CONCURRENT_UPDATES (см. ChatOrderedUpdateProcessor)
+RECORD_UPDATES = os.getenv('RECORD_UPDATES')  # jsonl для replay.py, пароль IRC из /start туда не пишется
+SNAPSHOT_FILE = os.getenv('SNAPSHOT_FILE', 'osu_sessions.json')  # состояние сессий между рестартами
+RECONNECT_STAGGER = float(os.getenv('RECONNECT_STAGGER', '0.5'))  # пауза между подключениями при старте
+SHUTDOWN_DRAIN_TIMEOUT = 10
+STARTUP_PROFILE = bool(os.getenv('STARTUP_PROFILE'))  # печатать тайминги старта
+HISTORY_SIZE = int(os.getenv('HISTORY_SIZE', '200'))  # строк на канал в памяти
+HISTORY_DB = os.getenv('HISTORY_DB')  # sqlite для вытесненных строк и поиска, без него только память
+HISTORY_KEEP = int(os.getenv('HISTORY_KEEP', '5000'))  # строк на канал на диске, старые удаляются
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.INFO)
 
 NICK, PASSWORD = range(2)
 user_sessions = {}
 osu_api_token = {"token": None, "expires":      0}
+shard_id = None        # номер воркера, None во фронте и без шардинга
+shard_members = []     # живые воркеры, фронт рассылает их после сбора всех SHARDS
+shard_writers = {}     # (фронт) номер воркера -> StreamWriter
+# (фронт) апдейты, пришедшие до раздачи чатов; epoch — номер текущего состава воркеров (и у фронта, и у воркера),
+# released — кто из воркеров уже отпустил чужие чаты этого состава
+shard_state = {"settled": False, "backlog": [], "epoch": 0, "released": set(), "all_released": None, "handoff": None}
+shard_procs = []       # (фронт) запущенные воркеры
+restoring = set()      # чаты, которые сейчас поднимаются из конфига
+irc_history = {}       # chat_id -> {канал: deque[(ts, ник, текст)]}
+history_db = {"conn": None, "fts": False, "executor": None, "spilled": {}}  # sqlite живёт в своём потоке
+lifecycle = {"shutting_down": False, "restart": False}
+restore_pending = {}   # чат -> (конфиг, снапшот), ждут своей очереди на подключение
+restore_inflight = {}  # чат -> снапшот, подключаются прямо сейчас
+
+
+# --- ПРОФИЛЬ СТАРТА ---
+def profile_mark(name, report=False):
+    """Запоминает, сколько прошло от запуска процесса (STARTUP_PROFILE=1)"""
+    if not STARTUP_PROFILE or name in startup_timings:
+        return
+    startup_timings[name] = time.perf_counter() - startup_t0
+    if report:
+        logging.info("Профиль старта:\n" + "\n".join(f"  {k}: {v * 1000:.0f} мс" for k, v in startup_timings.items()))
 
+async def profile_first_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    profile_mark("первый апдейт", report=True)
 
 # --- OSU API V2 ---
 async def get_osu_token():
+    import aiohttp
     try:
         if osu_api_token["token"] and osu_api_token["expires"] > time.time():
             return osu_api_token["token"]
@@ -64,6 +129,7 @@ def extract_score_id(score_url):
     return None, None
 
 async def fetch_score_v2(score_url):
+    import aiohttp
     try:
         mode, score_id = extract_score_id(score_url)
         if not score_id:
@@ -105,6 +171,8 @@ async def fetch_score_v2(score_url):
 
 # --- ГРАФИКА ---
 def draw_score_card(data, bg_bytes=None):
+    from PIL import Image, ImageDraw, ImageFont
+    profile_mark("импорт PIL")
     width, height = 800, 450
     try:
         if bg_bytes:   
@@ -140,25 +208,46 @@ def draw_score_card(data, bg_bytes=None):
     bio = BytesIO()
     img.save(bio, 'PNG')
     bio.seek(0)
+    profile_mark("первая карточка", report=True)
     return bio
 
 # --- СЕРВИС ---
-def save_user_data(chat_id, data_dict):
-    config = {}
-    if os.path.exists(CONFIG_FILE):
+@contextlib.contextmanager
+def config_lock():
+    """Блокирует конфиг между воркерами, без шардинга ничего не делает"""
+    if shard_id is None or fcntl is None:
+        yield
+        return
+    with open(CONFIG_FILE + '.lock', 'w') as lf:
+        fcntl.flock(lf, fcntl.LOCK_EX)
         try:
-            with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
-                config = json.load(f)
-        except:     
-            pass
-    cid = str(chat_id)
-    if cid not in config:
-        config[cid] = {}
-    if 'contacts' in data_dict:
-        data_dict['contacts'] = list(set(c. lower() for c in data_dict['contacts']))
-    config[cid].    update(data_dict)
-    with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
-        json.    dump(config, f, indent=4, ensure_ascii=False)
+            yield
+        finally:
+            fcntl.flock(lf, fcntl.LOCK_UN)
+
+def write_json(path, data):
+    """Пишет во временный файл и подменяет им старый, чтобы другой воркер не прочитал недописанный json"""
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=4, ensure_ascii=False)
+    os.replace(tmp, path)
+
+def save_user_data(chat_id, data_dict):
+    with config_lock():
+        config = {}
+        if os.path.exists(CONFIG_FILE):
+            try:
+                with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
+                    config = json.load(f)
+            except:     
+                pass
+        cid = str(chat_id)
+        if cid not in config:
+            config[cid] = {}
+        if 'contacts' in data_dict:
+            data_dict['contacts'] = list(set(c. lower() for c in data_dict['contacts']))
+        config[cid].    update(data_dict)
+        write_json(CONFIG_FILE, config)
 
 def load_user_settings(chat_id):
     """Загружает настройки пользователя из конфига"""
@@ -182,17 +271,185 @@ def load_user_settings(chat_id):
     }
 
 def clear_user_auth(chat_id):
-    if os.path.exists(CONFIG_FILE):
+    with config_lock():
+        if os.path.exists(CONFIG_FILE):
+            try:
+                with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
+                    config = json.load(f)
+                if str(chat_id) in config:
+                    config[str(chat_id)].pop('nick', None)
+                    config[str(chat_id)].pop('pass', None)
+                    write_json(CONFIG_FILE, config)
+            except: 
+                pass
+
+# --- ИСТОРИЯ ---
+def history_executor():
+    """Один поток на все запросы к sqlite: порядок записей сохраняется, а ожидание лока
+    (HISTORY_DB общий у всех воркеров) не вешает event loop"""
+    if history_db["executor"] is None:
+        history_db["executor"] = ThreadPoolExecutor(max_workers=1, thread_name_prefix='history')
+    return history_db["executor"]
+
+def get_history_db():
+    """(поток истории) Открывает sqlite для истории, если задан HISTORY_DB"""
+    if not HISTORY_DB:
+        return None
+    if history_db["conn"] is None:
+        conn = sqlite3.connect(HISTORY_DB, timeout=10)
+        # WAL: читатели не ждут писателей, а каждая запись — короткая транзакция
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS history (chat_id INTEGER, channel TEXT, ts INTEGER, nick TEXT, text TEXT)")
+        conn.execute("CREATE INDEX IF NOT EXISTS history_chan ON history (chat_id, channel, ts)")
         try:
-            with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
-                config = json.load(f)
-            if str(chat_id) in config:
-                config[str(chat_id)].pop('nick', None)
-                config[str(chat_id)].pop('pass', None)
-                with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
-                    json.dump(config, f, indent=4)
-        except: 
+            conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS history_fts USING fts5(text, content='history', content_rowid='rowid')")
+            conn.execute("CREATE TRIGGER IF NOT EXISTS history_ai AFTER INSERT ON history BEGIN "
+                         "INSERT INTO history_fts (rowid, text) VALUES (new.rowid, new.text); END")
+            conn.execute("CREATE TRIGGER IF NOT EXISTS history_ad AFTER DELETE ON history BEGIN "
+                         "INSERT INTO history_fts (history_fts, rowid, text) VALUES ('delete', old.rowid, old.text); END")
+            history_db["fts"] = True
+        except sqlite3.OperationalError:
+            # sqlite без fts5 — поиск через LIKE
             pass
+        conn.commit()
+        history_db["conn"] = conn
+    return history_db["conn"]
+
+def db_spill(chat_id, channel, lines):
+    """(поток истории) Пишет строки в sqlite одной транзакцией"""
+    try:
+        conn = get_history_db()
+        conn.executemany("INSERT INTO history (chat_id, channel, ts, nick, text) VALUES (?, ?, ?, ?, ?)",
+                         [(chat_id, channel, ts, nick, text) for ts, nick, text in lines])
+        # раз в 100 строк подрезаем канал до HISTORY_KEEP
+        key = (chat_id, channel)
+        spilled = history_db["spilled"].get(key, 0) + len(lines)
+        if spilled >= 100:
+            conn.execute("DELETE FROM history WHERE chat_id = ? AND channel = ? AND rowid <= "
+                         "(SELECT rowid FROM history WHERE chat_id = ? AND channel = ? ORDER BY rowid DESC LIMIT 1 OFFSET ?)",
+                         (chat_id, channel, chat_id, channel, HISTORY_KEEP))
+            spilled = 0
+        history_db["spilled"][key] = spilled
+        conn.commit()
+    except Exception as e:
+        logging.error(f"History spill error: {e}")
+
+def db_forget(chat_id):
+    """(поток истории) Удаляет всю историю чата с диска"""
+    try:
+        conn = get_history_db()
+        conn.execute("DELETE FROM history WHERE chat_id = ?", (chat_id,))
+        conn.commit()
+    except Exception as e:
+        logging.error(f"History forget error: {e}")
+
+def db_read(chat_id, channel, n):
+    """(поток истории) Последние n строк канала с диска, старые первыми"""
+    try:
+        rows = get_history_db().execute("SELECT ts, nick, text FROM history WHERE chat_id = ? AND channel = ? "
+                                        "ORDER BY ts DESC, rowid DESC LIMIT ?", (chat_id, channel, n)).fetchall()
+        return rows[::-1]
+    except Exception as e:
+        logging.error(f"History read error: {e}")
+        return []
+
+def db_search(chat_id, query, channel, n):
+    """(поток истории) Поиск по диску, возвращает (канал, ts, ник, текст), старые первыми"""
+    try:
+        conn = get_history_db()
+        if history_db["fts"]:
+            sql = ("SELECT channel, ts, nick, history.text FROM history_fts JOIN history ON history.rowid = history_fts.rowid "
+                   "WHERE history_fts MATCH ? AND chat_id = ?")
+            args = ['"' + query.replace('"', '""') + '"', chat_id]
+        else:
+            sql = "SELECT channel, ts, nick, text FROM history WHERE text LIKE ? AND chat_id = ?"
+            args = [f"%{query}%", chat_id]
+        if channel:
+            sql += " AND channel = ?"
+            args.append(channel.lower())
+        sql += " ORDER BY ts DESC, history.rowid DESC LIMIT ?"
+        args.append(n)
+        return conn.execute(sql, args).fetchall()[::-1]
+    except Exception as e:
+        logging.error(f"History search error: {e}")
+        return []
+
+def spill_history(chat_id, channel, lines):
+    """Скидывает строки из памяти на диск в фоне"""
+    if not HISTORY_DB or not lines:
+        return
+    try:
+        history_executor().submit(db_spill, chat_id, channel, lines)
+    except RuntimeError as e:
+        logging.error(f"History spill error: {e}")
+
+def record_history(chat_id, channel, nick, text):
+    """Кладёт строку канала в кольцевой буфер, вытесненная уходит на диск"""
+    chans = irc_history.setdefault(chat_id, {})
+    channel = sys.intern(channel.lower())
+    buf = chans.get(channel)
+    if buf is None:
+        buf = chans[channel] = deque(maxlen=HISTORY_SIZE)
+    if len(buf) == buf.maxlen:
+        spill_history(chat_id, channel, [buf[0]])
+    buf.append((int(time.time()), sys.intern(nick), text))
+
+def drop_history(chat_id):
+    """Убирает историю чата из памяти, сохраняя её на диск"""
+    for channel, buf in irc_history.pop(chat_id, {}).items():
+        spill_history(chat_id, channel, list(buf))
+
+def forget_history(chat_id):
+    """Стирает историю чата из памяти и с диска (для /stop)"""
+    irc_history.pop(chat_id, None)
+    if HISTORY_DB:
+        try:
+            history_executor().submit(db_forget, chat_id)
+        except RuntimeError as e:
+            logging.error(f"History forget error: {e}")
+
+async def flush_history():
+    """Дожидается, пока поток истории допишет всё, что ему отдали"""
+    if history_db["executor"]:
+        await asyncio.get_running_loop().run_in_executor(history_db["executor"], lambda: None)
+
+async def get_history(chat_id, channel, n):
+    channel = channel.lower()
+    lines = list(irc_history.get(chat_id, {}).get(channel, ()))[-n:]
+    if HISTORY_DB and len(lines) < n:
+        older = await asyncio.get_running_loop().run_in_executor(
+            history_executor(), db_read, chat_id, channel, n - len(lines))
+        lines = older + lines
+    return lines
+
+async def search_history(chat_id, query, channel=None, n=10):
+    """Ищет строки с query в памяти и на диске, возвращает (канал, ts, ник, текст)"""
+    found = []
+    if HISTORY_DB:
+        found = await asyncio.get_running_loop().run_in_executor(
+            history_executor(), db_search, chat_id, query, channel, n)
+    # в памяти самые свежие строки, они идут после дисковых
+    q = query.lower()
+    for ch, buf in irc_history.get(chat_id, {}).items():
+        if channel and ch != channel.lower():
+            continue
+        found += [(ch, ts, nick, text) for ts, nick, text in buf if q in text.lower()]
+    found.sort(key=lambda x: x[1])
+    return found[-n:]
+
+def format_history_line(ts, nick, text):
+    return f"{time.strftime('%H:%M', time.localtime(ts))} {nick}: {text[:300]}"
+
+def history_message(header, lines, limit=4000):
+    """Заголовок + строки истории; самые старые выкидываются, чтобы влезть в лимит телеги"""
+    body = []
+    size = len(header)
+    for line in reversed(lines):
+        size += len(line) + 1
+        if size > limit:
+            break
+        body.append(line)
+    return "\n".join([header] + body[::-1])
 
 # --- IRC ---
 async def irc_command_sender(chat_id, bot):
@@ -215,6 +472,7 @@ async def irc_command_sender(chat_id, bot):
                 u['writer']. write(f"{cmd}\r\n".   encode())
                 await asyncio.wait_for(u['writer']. drain(), timeout=3)
                 logging.debug(f"IRC отправлена команда: {cmd}")
+                u['command_queue'].task_done()
                 consecutive_errors = 0
                 await asyncio.sleep(0.5)
             except (asyncio.TimeoutError, OSError, BrokenPipeError, ConnectionResetError) as e:
@@ -252,7 +510,7 @@ async def send_irc_command(chat_id, command):
         logging.error(f"Queue error: {e}")
         return False
 
-async def connect_irc_session(bot, chat_id, n, p, c):
+async def connect_irc_session(bot, chat_id, n, p, c, notify=True):
     try:
         logging.info(f"Подключаюсь к {IRC_HOST}:{IRC_PORT} как {n}")
 
@@ -318,17 +576,19 @@ async def connect_irc_session(bot, chat_id, n, p, c):
             'send_reactions':    settings['send_reactions'],
             'nick':  n,
             'pass':     p,
+            'last_active': 0,
         }
 
         for contact in c:
             if contact.startswith('#'):
                 await send_irc_command(chat_id, f"JOIN {contact}")
 
-        asyncio.create_task(listen_irc(chat_id, r, w, bot))
+        user_sessions[chat_id]['listener'] = asyncio.create_task(listen_irc(chat_id, r, w, bot))
         asyncio.create_task(irc_command_sender(chat_id, bot))
         asyncio.create_task(heartbeat_irc(chat_id, bot))
 
-        await bot.send_message(chat_id, f"✅ IRC для **{n}** подключен!")
+        if notify:
+            await bot.send_message(chat_id, f"✅ IRC для **{n}** подключен!")
         return True
     except asyncio.TimeoutError:
         await bot.send_message(chat_id, "❌ Timeout при подключении к IRC")
@@ -426,6 +686,7 @@ async def listen_irc(chat_id, reader, writer, bot):
                                         logging.    error(f"Ошибка отправки ЛС: {e}")
                             else:
                                 # Сообщение из канала
+                                record_history(chat_id, target, sender, text)
                                 kb = None
                                 
                                 if u.  get('show_all_messages') and target != u.get('target'):
@@ -449,7 +710,7 @@ async def listen_irc(chat_id, reader, writer, bot):
 
 async def reconnect_irc(chat_id, bot):
     """Автоматическое переподключение с 3 попытками"""
-    if chat_id not in user_sessions:
+    if chat_id not in user_sessions or lifecycle["shutting_down"]:
         return
 
     if user_sessions[chat_id].    get('reconnecting'):
@@ -496,6 +757,193 @@ async def reconnect_irc(chat_id, bot):
         if chat_id in user_sessions:     
             user_sessions[chat_id]['reconnecting'] = False
 
+def close_irc_session(chat_id):
+    """Закрывает IRC сессию и убирает её из памяти"""
+    if chat_id in user_sessions:
+        user_sessions[chat_id]['active'] = False
+        try:
+            user_sessions[chat_id]['writer'].close()
+        except:
+            pass
+        del user_sessions[chat_id]
+    drop_history(chat_id)
+
+def save_session_snapshot(cids=None):
+    """Сохраняет состояние сессий (чат, режим удаления, каналы, неотправленное) в SNAPSHOT_FILE"""
+    snap = {}
+    for cid in list(user_sessions if cids is None else cids):
+        u = user_sessions[cid]
+        unsent = []
+        while not u['command_queue'].empty():
+            cmd = u['command_queue'].get_nowait()
+            u['command_queue'].task_done()
+            if cmd.startswith('PRIVMSG'):
+                unsent.append(cmd)
+        snap[cid] = {
+            'target': u['target'],
+            'del_mode': u['del_mode'],
+            'contacts': sorted(u['contacts']),
+            'unsent': unsent,
+            'last_active': u.get('last_active', 0),
+        }
+    put_session_snapshot(snap)
+    if snap:
+        logging.info(f"Снапшот: {len(snap)} сессий")
+
+def put_session_snapshot(snap):
+    """Дописывает записи {чат: состояние} в SNAPSHOT_FILE"""
+    if not snap:
+        return
+    with config_lock():
+        data = {}
+        if os.path.exists(SNAPSHOT_FILE):
+            try:
+                with open(SNAPSHOT_FILE, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            except:
+                pass
+        data.update({str(cid): d for cid, d in snap.items()})
+        write_json(SNAPSHOT_FILE, data)
+
+def take_session_snapshot(cids):
+    """Забирает из снапшота записи чатов cids, остальное оставляет другим воркерам и на потом"""
+    with config_lock():
+        if not os.path.exists(SNAPSHOT_FILE):
+            return {}
+        try:
+            with open(SNAPSHOT_FILE, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except:
+            return {}
+        mine = {int(cid): d for cid, d in data.items() if int(cid) in cids}
+        if mine:
+            rest = {cid: d for cid, d in data.items() if int(cid) not in mine}
+            if rest:
+                write_json(SNAPSHOT_FILE, rest)
+            else:
+                os.remove(SNAPSHOT_FILE)
+    return mine
+
+async def graceful_shutdown():
+    """Дожидается очередей IRC и отправок в телегу, сохраняет снапшот и закрывает сессии"""
+    lifecycle["shutting_down"] = True
+    queues = [u['command_queue'].join() for u in user_sessions.values() if u['active']]
+    if queues:
+        try:
+            await asyncio.wait_for(asyncio.gather(*queues), SHUTDOWN_DRAIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            logging.warning("Не все IRC команды успели уйти, сохраняю их в снапшот")
+    save_session_snapshot()
+    # чаты, до которых ещё не дошла очередь восстановления или которые подключаются прямо сейчас,
+    # иначе их снапшот уже забран из файла и пропадёт
+    waiting = {cid: snap for cid, (d, snap) in restore_pending.items() if snap}
+    waiting.update({cid: snap for cid, snap in restore_inflight.items() if snap and cid not in user_sessions})
+    put_session_snapshot(waiting)
+    restore_pending.clear()
+
+    # слушатели дописывают в телегу то, что уже прочитали
+    listeners = [u['listener'] for u in user_sessions.values() if u.get('listener')]
+    for cid in list(user_sessions):
+        close_irc_session(cid)
+    if listeners:
+        await asyncio.wait(listeners, timeout=SHUTDOWN_DRAIN_TIMEOUT)
+    await flush_history()
+
+async def restore_connect(bot, chat_id, d, snap):
+    restore_inflight[chat_id] = snap
+    try:
+        contacts = snap['contacts'] if snap else d.get('contacts', [])
+        ok = await connect_irc_session(bot, chat_id, d['nick'], d['pass'], contacts, notify=not snap)
+        if lifecycle["shutting_down"]:
+            # снапшот уже сохранил graceful_shutdown, сессию никто не закроет
+            close_irc_session(chat_id)
+            return
+        if not ok:
+            # снапшот пригодится при следующем старте
+            put_session_snapshot({chat_id: snap} if snap else {})
+            return
+        if snap:
+            u = user_sessions[chat_id]
+            u['target'] = snap.get('target', DEFAULT_CHANNEL)
+            u['del_mode'] = snap.get('del_mode', False)
+            u['last_active'] = snap.get('last_active', 0)
+            for cmd in snap.get('unsent', []):
+                await send_irc_command(chat_id, cmd)
+        if not owns_chat(chat_id):
+            # пока подключались, чат переехал на другой воркер — отдаём ему состояние
+            save_session_snapshot([chat_id])
+            close_irc_session(chat_id)
+    finally:
+        restore_inflight.pop(chat_id, None)
+        restoring.discard(chat_id)
+
+async def staggered_restore(bot):
+    """Подключает чаты из restore_pending по одному с паузой, чтобы не устраивать шторм на irc.ppy.sh"""
+    first = True
+    while restore_pending:
+        if not first:
+            await asyncio.sleep(RECONNECT_STAGGER)
+        first = False
+        if lifecycle["shutting_down"]:
+            put_session_snapshot({cid: snap for cid, (d, snap) in restore_pending.items() if snap})
+            restore_pending.clear()
+            return
+        if not restore_pending:
+            break
+        cid = next(iter(restore_pending))
+        d, snap = restore_pending.pop(cid)
+        if cid in user_sessions or not owns_chat(cid):
+            restoring.discard(cid)
+            continue
+        asyncio.create_task(restore_connect(bot, cid, d, snap))
+    profile_mark("восстановление сессий запущено", report=True)
+
+async def restore_on_demand(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Чат написал раньше, чем до него дошла очередь восстановления — поднимаем сразу.
+    Подключение не ждём (без CONCURRENT_UPDATES это встало бы всем), а честно говорим, что сообщение не ушло"""
+    chat = update.effective_chat
+    if not chat or chat.id not in restoring or chat.id in user_sessions:
+        return
+    if chat.id in restore_pending:
+        d, snap = restore_pending.pop(chat.id)
+        asyncio.create_task(restore_connect(context.bot, chat.id, d, snap))
+    notice = "⏳ Восстанавливаю подключение к IRC, повторите через пару секунд"
+    try:
+        if update.callback_query:
+            await update.callback_query.answer(notice)
+        elif update.message:
+            await update.message.reply_text(notice)
+    except BadRequest:
+        pass
+    raise ApplicationHandlerStop
+
+def restore_sessions(bot):
+    """Поднимает из конфига и снапшота IRC сессии своих чатов, которых ещё нет в памяти"""
+    if not os.path.exists(CONFIG_FILE):
+        return
+    try:
+        with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
+            cfg = json.load(f)
+        found = {}
+        for cid, d in cfg.items():
+            cid = int(cid)
+            if cid in user_sessions or cid in restoring or not owns_chat(cid):
+                continue
+            if 'nick' in d and 'pass' in d:
+                found[cid] = d
+        snapshot = take_session_snapshot(found)
+        todo = [(cid, d, snapshot.get(cid)) for cid, d in found.items()]
+        # сначала те, кто недавно писал
+        todo.sort(key=lambda x: -(x[2] or {}).get('last_active', 0))
+        idle = not restore_pending
+        for cid, d, snap in todo:
+            restoring.add(cid)
+            restore_pending[cid] = (d, snap)
+        if todo and idle:
+            asyncio.create_task(staggered_restore(bot))
+    except Exception as e:
+        logging.error(f"Restore sessions error: {e}")
+
 # --- КОМАНДЫ ---
 async def start_handler(update:   Update, context:  ContextTypes.  DEFAULT_TYPE):
     cid = update.  effective_chat.  id
@@ -530,6 +978,7 @@ async def get_pass(update, context):
     save_user_data(cid, {'nick': n, 'pass': p, 'contacts': [DEFAULT_CHANNEL]})
     ok = await connect_irc_session(context.bot, cid, n, p, [DEFAULT_CHANNEL])
     if ok:
+        context.user_data.pop('temp_nick', None)
         await show_menu(update, context)
         return ConversationHandler.  END
     else:
@@ -607,6 +1056,9 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     cid, text = update.effective_chat.id, update.message.text
     u = user_sessions.get(cid)
 
+    if u:
+        u['last_active'] = time.time()
+
     if u and u.   get('target') and u.    get('active'):
         if len(text) > 500:
             await update.message.    reply_text("❌ Сообщение слишком длинное (макс 500 символов)")
@@ -616,6 +1068,8 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         send_success = await send_irc_command(cid, f"PRIVMSG {u['target']} :{text}")
         
         if send_success:
+            if u['target'].startswith('#'):
+                record_history(cid, u['target'], u['nick'], text)
             # Отправляем реакцию только если отправка успешна
             try:
                 if u.  get('send_reactions', True):
@@ -632,6 +1086,7 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if data:
             bg = None
             if data['CoverUrl']:
+                import aiohttp
                 try:
                     async with aiohttp.ClientSession() as sess:
                         async with sess.    get(data['CoverUrl']) as r:
@@ -668,6 +1123,8 @@ async def show_menu(update, context):
         ) for c in cts[i:    i+2]]
         kb.  append(row)
 
+    if u['target'].startswith('#') and irc_history.get(cid, {}).get(u['target'].lower()):
+        kb.append([InlineKeyboardButton(f"📜 История {u['target']}", callback_data=f"hist:{u['target']}")])
     kb.append([InlineKeyboardButton("🗑 Режим удаления:     " + ("ВКЛ" if dm else "ВЫКЛ"), callback_data="toggle_del")])
     kb.append([InlineKeyboardButton("⚙️ Настройки", callback_data="settings")])
 
@@ -687,6 +1144,7 @@ async def btn_handler(update, context):
 
     if not u:
         return
+    u['last_active'] = time.time()
 
     if q.data == "toggle_del":
         u['del_mode'] = not u['del_mode']
@@ -712,6 +1170,10 @@ async def btn_handler(update, context):
         u['target'] = target
         u['del_mode'] = False
         await show_menu(update, context)
+    elif q.data.startswith("hist:"):
+        channel = q.data.split(":", 1)[1]
+        lines = [format_history_line(*line) for line in await get_history(cid, channel, 20)]
+        await q.message.reply_text(history_message(f"📜 {channel}:", lines or ["пусто"]))
     elif q.data.  startswith("del:"):
         t = q.data.  split(":   ")[1]
         if t in u['contacts']:
@@ -719,38 +1181,378 @@ async def btn_handler(update, context):
         save_user_data(cid, {'contacts': list(u['contacts'])})
         await show_menu(update, context)
 
+async def history_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/history [#канал] [n] — последние строки канала"""
+    cid = update.effective_chat.id
+    u = user_sessions.get(cid)
+    if not u:
+        return await update.message.reply_text("❌ IRC не запущен.  /start")
+
+    channel, n = u['target'], 20
+    for arg in context.args:
+        if arg.startswith('#'):
+            channel = arg
+        elif arg.isdigit():
+            n = max(1, min(int(arg), 100))
+    if not channel.startswith('#'):
+        return await update.message.reply_text("📝 Использование: /history #канал 20")
+
+    lines = await get_history(cid, channel, n)
+    if not lines:
+        return await update.message.reply_text(f"📜 В {channel} пока ничего не было")
+    lines = [format_history_line(*line) for line in lines]
+    await update.message.reply_text(history_message(f"📜 {channel}:", lines))
+
+async def search_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/search слово [#канал] — поиск по истории каналов"""
+    cid = update.effective_chat.id
+    channel = next((a for a in context.args if a.startswith('#')), None)
+    query = " ".join(a for a in context.args if a != channel)
+    if not query:
+        return await update.message.reply_text("📝 Использование: /search слово или /search слово #канал")
+
+    found = await search_history(cid, query, channel)
+    if not found:
+        return await update.message.reply_text("🔎 Ничего не нашёл")
+    lines = [f"[{ch}] " + format_history_line(ts, nick, t) for ch, ts, nick, t in found]
+    await update.message.reply_text(history_message(f"🔎 {query}:", lines))
+
 async def stop_handler(update:     Update, context: ContextTypes.    DEFAULT_TYPE):
     cid = update.effective_chat.id
     clear_user_auth(cid)
-    if cid in user_sessions:  
-        user_sessions[cid]['active'] = False
-        try:
-            user_sessions[cid]['writer']. close()
-        except:
-            pass
-        del user_sessions[cid]
+    forget_history(cid)
+    close_irc_session(cid)
     await update.message.reply_text("🗑 Данные очищены.     Используйте /start для нового входа.")
 
-async def post_init(app:     Application):
-    await app.bot.set_my_commands([
+async def set_bot_commands(bot):
+    await bot.set_my_commands([
         BotCommand("menu", "Чаты"),
         BotCommand("add", "Добавить канал/ЛС"),
         BotCommand("settings", "Настройки"),
+        BotCommand("history", "История канала"),
+        BotCommand("search", "Поиск по истории"),
         BotCommand("stop", "Сброс"),
         BotCommand("start", "Вход")
     ])
-    if os.path.exists(CONFIG_FILE):
+
+def install_restart_signal(app):
+    """SIGHUP — горячий рестарт: мягкая остановка со снапшотом и перезапуск процесса"""
+    if not hasattr(signal, 'SIGHUP'):
+        return
+
+    def on_hup():
+        logging.info("SIGHUP, перезапускаюсь...")
+        lifecycle["restart"] = True
+        app.stop_running()
+
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, on_hup)
+    except NotImplementedError:
+        pass
+
+async def post_init(app:     Application):
+    await set_bot_commands(app.bot)
+    install_restart_signal(app)
+    restore_sessions(app.bot)
+    profile_mark("post_init, бот отвечает")
+
+async def post_stop(app: Application):
+    await graceful_shutdown()
+
+# --- ШАРДИНГ ---
+def shard_for(chat_id, members):
+    """Rendezvous-хеш: при добавлении воркера переезжает только его доля чатов"""
+    return max(members, key=lambda s: hashlib.blake2b(f"{s}:{chat_id}".encode(), digest_size=8).digest())
+
+def owns_chat(chat_id):
+    if shard_id is None:
+        return True
+    return bool(shard_members) and shard_for(chat_id, shard_members) == shard_id
+
+async def shard_send(writer, msg):
+    writer.write((json.dumps(msg, ensure_ascii=False) + "\n").encode())
+    await writer.drain()
+
+async def broadcast_members():
+    """(фронт) Рассылает состав воркеров, но только когда все SHARDS подключились или вышел SHARD_SETTLE,
+    иначе первый воркер успеет начать подключать все чаты"""
+    global shard_members
+    if not shard_state["settled"]:
+        if len(shard_writers) < SHARDS:
+            return
+        shard_state["settled"] = True
+    shard_members = sorted(shard_writers)
+    shard_state["epoch"] += 1
+    shard_state["released"] = set()
+    shard_state["all_released"] = asyncio.Event()
+    if shard_state["handoff"]:
+        shard_state["handoff"].cancel()
+    logging.info(f"Воркеры: {shard_members}")
+    for sid, w in list(shard_writers.items()):
         try:
-            with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
-                cfg = json.load(f)
-                for cid, d in cfg.items():
-                    if 'nick' in d and 'pass' in d:  
-                        asyncio.create_task(connect_irc_session(app.  bot, int(cid), d['nick'], d['pass'], d.   get('contacts', [])))
-        except Exception as e:  
-            logging.error(f"Post init error: {e}")
+            await shard_send(w, {"op": "members", "shards": shard_members, "epoch": shard_state["epoch"]})
+        except Exception as e:
+            logging.error(f"Shard {sid} members error: {e}")
+    shard_state["handoff"] = asyncio.create_task(finish_handoff(shard_state["epoch"]))
+    backlog, shard_state["backlog"] = shard_state["backlog"], []
+    for update in backlog:
+        await forward_update(update)
+
+def shard_released(sid, epoch):
+    """(фронт) Воркер сохранил снапшот уехавших чатов и закрыл их сессии"""
+    if epoch != shard_state["epoch"]:
+        return
+    shard_state["released"].add(sid)
+    if shard_state["released"] >= set(shard_writers):
+        shard_state["all_released"].set()
 
-def main():
-    app = Application.builder().token(TOKEN).post_init(post_init).build()
+async def finish_handoff(epoch):
+    """(фронт) Разрешает воркерам поднимать новые чаты, только когда старые хозяева их отпустили,
+    иначе новый хозяин заберёт снапшот раньше, чем старый его запишет, и сессия будет в двух местах"""
+    try:
+        await asyncio.wait_for(shard_state["all_released"].wait(), SHARD_HANDOFF_TIMEOUT)
+    except asyncio.TimeoutError:
+        stuck = sorted(set(shard_writers) - shard_state["released"])
+        logging.warning(f"Воркеры {stuck} не отпустили чаты за {SHARD_HANDOFF_TIMEOUT} с, поднимаем без них")
+    if epoch != shard_state["epoch"]:
+        return
+    for sid, w in list(shard_writers.items()):
+        try:
+            await shard_send(w, {"op": "restore", "epoch": epoch})
+        except Exception as e:
+            logging.error(f"Shard {sid} restore error: {e}")
+
+async def settle_shards():
+    await asyncio.sleep(SHARD_SETTLE)
+    if not shard_state["settled"]:
+        logging.warning(f"Подключились не все воркеры: {sorted(shard_writers)}")
+        shard_state["settled"] = True
+        await broadcast_members()
+
+async def shard_front_client(reader, writer):
+    """(фронт) Соединение с воркером: hello, потом подтверждения released, пока не отвалится"""
+    sid = None
+    try:
+        hello = json.loads(await reader.readline())
+        sid = int(hello['shard'])
+        old = shard_writers.get(sid)
+        if old:
+            old.close()
+        shard_writers[sid] = writer
+        await broadcast_members()
+        while line := await reader.readline():
+            msg = json.loads(line)
+            if msg['op'] == 'released':
+                shard_released(sid, msg['epoch'])
+    except Exception as e:
+        logging.error(f"Shard link error: {e}")
+    finally:
+        if sid is not None and shard_writers.get(sid) is writer:
+            del shard_writers[sid]
+            await broadcast_members()
+        writer.close()
+
+async def forward_update(update):
+    chat = update.effective_chat
+    if not chat:
+        return
+    w = None
+    if shard_members:
+        sid = shard_for(chat.id, shard_members)
+        w = shard_writers.get(sid)
+    if not w:
+        logging.warning(f"Нет живых воркеров, апдейт для {chat.id} потерян")
+        return
+    try:
+        await shard_send(w, {"op": "update", "update": update.to_dict()})
+    except Exception as e:
+        logging.error(f"Route to shard {sid} error: {e}")
+
+async def route_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """(фронт) Пересылает апдейт воркеру, которому принадлежит чат"""
+    if shard_state["settled"]:
+        await forward_update(update)
+    else:
+        shard_state["backlog"].append(update)
+    raise ApplicationHandlerStop
+
+async def shard_front_init(app: Application):
+    await set_bot_commands(app.bot)
+    install_restart_signal(app)
+    if os.path.exists(SHARD_SOCKET):
+        os.remove(SHARD_SOCKET)
+    old_umask = os.umask(0o177)
+    try:
+        app.bot_data['shard_server'] = await asyncio.start_unix_server(shard_front_client, SHARD_SOCKET)
+    finally:
+        os.umask(old_umask)
+    os.chmod(SHARD_SOCKET, 0o600)
+    for i in range(SHARDS):
+        shard_procs.append(subprocess.Popen([sys.executable, os.path.abspath(__file__), '--worker', str(i)]))
+    asyncio.create_task(settle_shards())
+
+async def shard_front_shutdown(app: Application):
+    app.bot_data['shard_server'].close()
+    if os.path.exists(SHARD_SOCKET):
+        os.remove(SHARD_SOCKET)
+    for proc in shard_procs:
+        proc.terminate()
+    for proc in shard_procs:
+        try:
+            proc.wait(timeout=SHUTDOWN_DRAIN_TIMEOUT * 3)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+async def rebalance_shard(members, epoch):
+    """(воркер) Отдаёт чужие чаты после смены состава воркеров. Свои поднимаются позже,
+    по команде restore от фронта, когда все воркеры отпустили свои"""
+    global shard_members
+    shard_members = members
+    shard_state["epoch"] = epoch
+    # чаты, которые прямо сейчас подключаются, сами отдадут снапшот в restore_connect — ждём их
+    busy = [cid for cid in restore_inflight if not owns_chat(cid)]
+    deadline = time.monotonic() + SHARD_HANDOFF_TIMEOUT
+    while any(cid in restore_inflight for cid in busy) and time.monotonic() < deadline:
+        await asyncio.sleep(0.1)
+    # состояние уехавших чатов пишем в снапшот, новый хозяин заберёт его после restore
+    moved = [cid for cid in user_sessions if not owns_chat(cid)]
+    save_session_snapshot(moved)
+    for cid in moved:
+        logging.info(f"Чат {cid} переехал на воркер {shard_for(cid, members)}")
+        close_irc_session(cid)
+    pending = {cid: restore_pending.pop(cid) for cid in list(restore_pending) if not owns_chat(cid)}
+    put_session_snapshot({cid: snap for cid, (d, snap) in pending.items() if snap})
+    restoring.difference_update(pending)
+
+async def shard_worker_link(app: Application):
+    """(воркер) Держит соединение с фронтом и принимает апдейты"""
+    while True:
+        try:
+            if os.stat(SHARD_SOCKET).st_uid != os.getuid():
+                raise PermissionError(f"{SHARD_SOCKET} создан чужим пользователем")
+            r, w = await asyncio.open_unix_connection(SHARD_SOCKET)
+        except PermissionError as e:
+            logging.error(f"Shard link error: {e}")
+            await asyncio.sleep(5)
+            continue
+        except OSError:
+            await asyncio.sleep(1)
+            continue
+        try:
+            await shard_send(w, {"op": "hello", "shard": shard_id})
+            while line := await r.readline():
+                msg = json.loads(line)
+                if msg['op'] == 'update':
+                    await app.update_queue.put(Update.de_json(msg['update'], app.bot))
+                elif msg['op'] == 'members':
+                    await rebalance_shard(msg['shards'], msg['epoch'])
+                    await shard_send(w, {"op": "released", "epoch": msg['epoch']})
+                elif msg['op'] == 'restore':
+                    if msg['epoch'] == shard_state["epoch"] and not lifecycle["shutting_down"]:
+                        restore_sessions(app.bot)
+        except (OSError, ValueError) as e:
+            logging.error(f"Shard link error: {e}")
+        w.close()
+        logging.warning("Фронт отключился, переподключаюсь...")
+        await asyncio.sleep(1)
+
+async def run_shard_worker(sid):
+    global shard_id
+    shard_id = sid
+    app = new_builder().updater(None).build()
+    add_handlers(app)
+    stop = asyncio.Event()
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set)
+    except (NotImplementedError, AttributeError):
+        pass
+    async with app:
+        await app.start()
+        profile_mark(f"воркер {sid} запущен", report=True)
+        link = asyncio.create_task(shard_worker_link(app))
+        try:
+            await stop.wait()
+        finally:
+            await app.stop()
+            # связь с фронтом рвём только после снапшота: по разрыву фронт отдаёт наши чаты другим
+            await graceful_shutdown()
+            link.cancel()
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Разные чаты обрабатываются параллельно, апдейты одного чата — строго по очереди,
+    потому что user_sessions[cid] и ConversationHandler живут без локов.
+
+    Семафор базового класса берётся раньше do_process_update, то есть до лока чата: апдейты
+    одного занятого чата заняли бы все слоты, пока ждут свой лок, и остальные чаты стояли бы.
+    Поэтому базе отдаём заведомо большой лимит, а настоящий держим свой и берём после лока"""
+
+    def __init__(self, max_concurrent_updates):
+        super().__init__(PROCESSOR_BASE_LIMIT)
+        self.slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self.chat_locks = {}
+        self.chat_pending = {}
+
+    async def do_process_update(self, update, coroutine):
+        chat = getattr(update, 'effective_chat', None)
+        if not chat:
+            async with self.slots:
+                await coroutine
+            return
+        cid = chat.id
+        lock = self.chat_locks.setdefault(cid, asyncio.Lock())
+        self.chat_pending[cid] = self.chat_pending.get(cid, 0) + 1
+        try:
+            async with lock:
+                async with self.slots:
+                    await coroutine
+        finally:
+            self.chat_pending[cid] -= 1
+            if not self.chat_pending[cid]:
+                del self.chat_pending[cid]
+                del self.chat_locks[cid]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+def new_builder():
+    builder = Application.builder().token(TOKEN)
+    if CONCURRENT_UPDATES > 1:
+        builder = builder.concurrent_updates(ChatOrderedUpdateProcessor(CONCURRENT_UPDATES))
+    return builder
+
+async def record_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Пишет апдейт в RECORD_UPDATES, чтобы потом прогнать его через replay.py"""
+    data = update.to_dict()
+    # temp_nick есть, пока ConversationHandler ждёт пароль — его текст не сохраняем.
+    # id таких сообщений запоминаем: пароль могут потом отредактировать, и правка
+    # придёт отдельным edited_message уже после того, как диалог закончился
+    ud = context.user_data if context.user_data is not None else {}
+    waiting_pass = 'temp_nick' in ud
+    secret = ud.setdefault('secret_msgs', [])
+    for key in ('message', 'edited_message'):
+        msg = data.get(key)
+        if not msg or 'text' not in msg:
+            continue
+        mid = msg.get('message_id')
+        if waiting_pass and mid not in secret:
+            secret.append(mid)
+            del secret[:-20]
+        if mid in secret:
+            msg['text'] = '***'
+    try:
+        with open(RECORD_UPDATES, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(data, ensure_ascii=False) + "\n")
+    except Exception as e:
+        logging.error(f"Record update error: {e}")
+
+def add_handlers(app):
+    # пишем там, где живёт состояние диалога, чтобы знать, какое сообщение — пароль
+    if RECORD_UPDATES:
+        app.add_handler(TypeHandler(Update, record_update), group=-3)
+    app.add_handler(TypeHandler(Update, restore_on_demand), group=-2)
     conv = ConversationHandler(
         entry_points=[CommandHandler('start', start_handler)],
         states={
@@ -763,10 +1565,46 @@ def main():
     app.add_handler(CommandHandler("menu", show_menu))
     app.add_handler(CommandHandler("add", add_handler))
     app.add_handler(CommandHandler("settings", settings_handler))
+    app.add_handler(CommandHandler("history", history_handler))
+    app.add_handler(CommandHandler("search", search_handler))
     app.add_handler(CommandHandler("stop", stop_handler))
     app.add_handler(CallbackQueryHandler(btn_handler))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, message_handler))
-    app.run_polling()
+
+def run_app(app):
+    profile_mark("приложение собрано")
+    if STARTUP_PROFILE:
+        app.add_handler(TypeHandler(Update, profile_first_update), group=-4)
+    if WEBHOOK_URL:
+        if not WEBHOOK_SECRET:
+            # без секрета PTB принимает любой POST: кто узнал адрес, пишет в IRC от имени любого чата
+            logging.error("WEBHOOK_URL задан без WEBHOOK_SECRET, не запускаюсь")
+            sys.exit(1)
+        app.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+        )
+    else:
+        app.run_polling()
+    if lifecycle["restart"]:
+        os.execv(sys.executable, [sys.executable] + sys.argv)
+
+def main():
+    if '--worker' in sys.argv:
+        asyncio.run(run_shard_worker(int(sys.argv[sys.argv.index('--worker') + 1])))
+        return
+    if SHARDS > 0:
+        app = new_builder().post_init(shard_front_init).post_shutdown(shard_front_shutdown).build()
+        app.add_handler(TypeHandler(Update, route_update))
+        run_app(app)
+        return
+    app = new_builder().post_init(post_init).post_stop(post_stop).build()
+    add_handlers(app)
+    run_app(app)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,129 @@
+# прогоняет записанные апдейты (RECORD_UPDATES=updates.jsonl) через хендлеры бота и меряет скорость
+#
+#   python replay.py updates.jsonl                 — как long polling: апдейты сразу в update_queue
+#   python replay.py updates.jsonl --webhook -c 20 — как вебхук: каждый апдейт приходит POST'ом на локальный
+#                                                    HTTP, до 20 запросов одновременно, как шлёт телега
+#   python replay.py updates.jsonl --irc           — сначала поднять IRC сессии из osu_config.json
+#
+# Оба режима считают время до конца работы всех хендлеров (update_queue.join()), так что цифры сравнимы.
+# HTTP в режиме --webhook — свой на aiohttp, повторяет то, что делает вебхук PTB: проверка секрета,
+# разбор json, апдейт в очередь, 200.
+#
+# Без --irc у записанных чатов нет сессий и большинство хендлеров выходит на "IRC не запущен" —
+# это замер только диспетчеризации. С --irc чаты из записи должны быть в osu_config.json с ником и
+# паролем, а сообщения реально уйдут в IRC и телегу — гоняйте на тестовом боте и тестовых аккаунтах.
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+import aiohttp
+from aiohttp import web
+from telegram import Update
+
+import main as bot_main
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+def load_updates(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def report(name, count, elapsed):
+    print(f"{name}: {count} апдейтов за {elapsed:.3f} с ({count / elapsed:.1f} апд/с), до конца работы хендлеров")
+
+
+async def bring_up_sessions(app, timeout=120):
+    """Поднимает IRC сессии из конфига так же, как post_init, и ждёт конца восстановления"""
+    # снапшот боевого бота не трогаем: restore_sessions забирает из него записи
+    bot_main.SNAPSHOT_FILE = os.path.join(tempfile.mkdtemp(), 'osu_sessions.json')
+    bot_main.restore_sessions(app.bot)
+    deadline = time.monotonic() + timeout
+    while bot_main.restoring and time.monotonic() < deadline:
+        await asyncio.sleep(0.5)
+    print(f"IRC сессий поднято: {len(bot_main.user_sessions)}, не успели: {len(bot_main.restoring)}")
+
+
+def close_sessions():
+    bot_main.lifecycle["shutting_down"] = True
+    for cid in list(bot_main.user_sessions):
+        bot_main.close_irc_session(cid)
+
+
+async def feed_polling(app, updates, concurrency):
+    """Кладёт апдейты в update_queue — ровно туда же, куда их кладёт Updater при polling"""
+    for data in updates:
+        await app.update_queue.put(Update.de_json(data, app.bot))
+
+
+async def feed_webhook(app, updates, concurrency):
+    """Поднимает локальный HTTP и шлёт в него апдейты POST'ами, как телега в вебхук"""
+    async def handle(request):
+        if bot_main.WEBHOOK_SECRET and request.headers.get(SECRET_HEADER) != bot_main.WEBHOOK_SECRET:
+            return web.Response(status=403)
+        data = await request.json()
+        await app.update_queue.put(Update.de_json(data, app.bot))
+        return web.Response()
+
+    http = web.Application()
+    http.router.add_post('/' + bot_main.WEBHOOK_PATH, handle)
+    runner = web.AppRunner(http, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    url = f"http://127.0.0.1:{port}/{bot_main.WEBHOOK_PATH}"
+    headers = {SECRET_HEADER: bot_main.WEBHOOK_SECRET} if bot_main.WEBHOOK_SECRET else {}
+    sem = asyncio.Semaphore(concurrency)
+
+    async def post(session, data):
+        async with sem:
+            async with session.post(url, json=data, headers=headers) as resp:
+                if resp.status != 200:
+                    print(f"апдейт {data.get('update_id')}: HTTP {resp.status}")
+
+    try:
+        async with aiohttp.ClientSession() as session:
+            await asyncio.gather(*(post(session, data) for data in updates))
+    finally:
+        await runner.cleanup()
+
+
+async def replay(updates, feed, name, concurrency, with_irc):
+    app = bot_main.new_builder().updater(None).build()
+    bot_main.add_handlers(app)
+    async with app:
+        await app.start()
+        if with_irc:
+            await bring_up_sessions(app)
+        start = time.perf_counter()
+        await feed(app, updates, concurrency)
+        await app.update_queue.join()
+        elapsed = time.perf_counter() - start
+        await app.stop()
+        close_sessions()
+    report(name, len(updates), elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay записанных апдейтов")
+    parser.add_argument('file', help="jsonl из RECORD_UPDATES")
+    parser.add_argument('--webhook', action='store_true', help="доставлять апдейты через локальный HTTP, как вебхук")
+    parser.add_argument('-c', '--concurrency', type=int, default=bot_main.WEBHOOK_MAX_CONNECTIONS,
+                        help="сколько POST'ов одновременно в режиме --webhook")
+    parser.add_argument('--irc', action='store_true', help="перед замером поднять IRC сессии из osu_config.json")
+    args = parser.parse_args()
+
+    updates = load_updates(args.file)
+    if args.webhook:
+        asyncio.run(replay(updates, feed_webhook, "webhook", args.concurrency, args.irc))
+    else:
+        asyncio.run(replay(updates, feed_polling, "polling", args.concurrency, args.irc))
+
+
+if __name__ == '__main__':
+    main()